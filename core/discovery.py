@@ -2,6 +2,7 @@
 # Envía Echo-Requests, procesa respuestas y mantiene registro de peers
 # Filtra IPs locales para prevenir auto-descubrimiento
 
+import logging
 import socket
 import time
 import threading
@@ -20,6 +21,9 @@ from core.protocol import (
 )
 from util import get_local_ip_and_broadcast
 
+# Los echos y respuestas llegan cada segundo: su traza va a nivel DEBUG
+log = logging.getLogger(__name__)
+
 # Umbral para considerar un peer desconectado (segundos)
 OFFLINE_THRESHOLD = 20.0
 
@@ -37,6 +41,14 @@ class Discovery:
         self.broadcast_interval = broadcast_interval
         self.peers_store       = peers_store
 
+        # Paquetes de descubrimiento precalculados (constantes para este peer)
+        self._echo_request = pack_header(
+            user_from=self.user_id,
+            user_to=BROADCAST_UID,
+            op_code=0
+        )
+        self._echo_reply = pack_response(0, self.user_id)
+
         # Detección de IP y dirección broadcast
         try:
             self.local_ip, self.broadcast_addr = get_local_ip_and_broadcast()
@@ -54,9 +66,16 @@ class Discovery:
             self.broadcast_addr = "255.255.255.255"
             self.local_ips = {"127.0.0.1"}
 
+        # Destino fijo de los Echo-Request
+        self._broadcast_dest = (self.broadcast_addr, UDP_PORT)
+
         # Mapa de peers: {id_con_padding: {'ip': str, 'last_seen': datetime}}
         self.peers = {}
 
+        # Memo de IDs ya decodificados: {clave: (nombre, id_con_padding)}
+        # Los IDs de un peer no cambian, así que nunca hace falta invalidarlo
+        self._decoded_ids = {}
+
         # Socket UDP para broadcast
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -114,19 +133,14 @@ class Discovery:
             time.sleep(self.broadcast_interval)
 
     # Envía un Echo-Request por broadcast
-    # Empaqueta mensaje y maneja errores
+    # Reutiliza el paquete precalculado y maneja errores
     def _do_broadcast(self):
-        pkt = pack_header(
-            user_from=self.user_id,
-            user_to=BROADCAST_UID,
-            op_code=0
-        )
         try:
             # Broadcast usando la dirección detectada
-            self.sock.sendto(pkt, (self.broadcast_addr, UDP_PORT))
-            print(f"Broadcast enviado desde {self.local_ip} con ID {self.raw_id}")
+            self.sock.sendto(self._echo_request, self._broadcast_dest)
+            log.debug("Broadcast enviado desde %s con ID %r", self.local_ip, self.raw_id)
         except Exception as e:
-            print(f"Error al enviar broadcast: {e}")
+            log.warning("Error al enviar broadcast: %s", e)
 
     # Fuerza broadcast inmediato
     def force_discover(self):
@@ -147,7 +161,7 @@ class Discovery:
                 status = 'connected' if age < OFFLINE_THRESHOLD else 'disconnected'
                 
                 # Conversión de identificador para almacenamiento
-                key = uid.decode('utf-8', errors='ignore') if isinstance(uid, bytes) else uid
+                key = self._decode_peer_id(uid)[0]
                 
                 to_save[key] = {
                     'ip':         ip,
@@ -157,31 +171,30 @@ class Discovery:
             try:
                 self.peers_store.save(to_save)
             except Exception as e:
-                print(f"Error guardando peers: {e}")
+                log.error("Error guardando peers: %s", e)
 
     # Procesa Echo-Request y responde al peer
     # Filtra auto-mensajes y actualiza registro de peers
     def handle_echo(self, data: bytes, addr):
         try:
             hdr      = unpack_header(data[:HEADER_SIZE])
-            raw_id   = hdr['user_from']                    # ID sin padding
+            raw_id   = hdr.user_from                    # ID sin padding
             raw_peer = raw_id.ljust(20, b'\x00')           # ID con padding
             peer_ip  = addr[0]
 
-            print(f"Echo recibido de {peer_ip} con ID {raw_id}")
+            log.debug("Echo recibido de %s con ID %r", peer_ip, raw_id)
 
             # Evita auto-descubrimiento
             if peer_ip in self.local_ips or raw_id == self.raw_id:
-                print(f"Ignorando echo de IP local o self: {peer_ip}")
+                log.debug("Ignorando echo de IP local o self: %s", peer_ip)
                 return
 
             # Envía respuesta
             try:
-                resp = pack_response(0, self.user_id)
-                self.sock.sendto(resp, addr)
-                print(f"Respuesta echo enviada a {peer_ip}")
+                self.sock.sendto(self._echo_reply, addr)
+                log.debug("Respuesta echo enviada a %s", peer_ip)
             except Exception as e:
-                print(f"Error al enviar respuesta echo: {e}")
+                log.warning("Error al enviar respuesta echo: %s", e)
                 return
 
             # Limpia registros antiguos con misma IP
@@ -194,24 +207,24 @@ class Discovery:
                 'ip':        peer_ip,
                 'last_seen': datetime.now(UTC)
             }
-            print(f"Peer actualizado: {peer_ip}")
+            log.debug("Peer actualizado: %s", peer_ip)
         except Exception as e:
-            print(f"Error procesando echo: {e}")
+            log.error("Error procesando echo: %s", e)
 
     # Procesa Echo-Reply y actualiza registro de peers
     # Verifica validez de la respuesta y filtra auto-respuestas
     def handle_response(self, data: bytes, addr):
         try:
             resp     = unpack_response(data[:RESPONSE_SIZE])
-            resp_id  = resp['responder']                   # ID sin padding
+            resp_id  = resp.responder                   # ID sin padding
             raw_peer = resp_id.ljust(20, b'\x00')          # ID con padding
             peer_ip  = addr[0]
 
-            print(f"Respuesta recibida de {peer_ip} con ID {resp_id}")
+            log.debug("Respuesta recibida de %s con ID %r", peer_ip, resp_id)
 
             # Filtra respuestas inválidas o propias
-            if resp['status'] != 0 or peer_ip in self.local_ips or resp_id == self.raw_id:
-                print(f"Ignorando respuesta de IP local o self: {peer_ip}")
+            if resp.status != 0 or peer_ip in self.local_ips or resp_id == self.raw_id:
+                log.debug("Ignorando respuesta de IP local o self: %s", peer_ip)
                 return
 
             # Limpia registros antiguos con misma IP
@@ -224,9 +237,9 @@ class Discovery:
                 'ip':        peer_ip,
                 'last_seen': datetime.now(UTC)
             }
-            print(f"Peer actualizado desde respuesta: {peer_ip}")
+            log.debug("Peer actualizado desde respuesta: %s", peer_ip)
         except Exception as e:
-            print(f"Error procesando respuesta: {e}")
+            log.error("Error procesando respuesta: %s", e)
 
     # Retorna mapa de peers activos excluyendo IPs locales
     def get_peers(self) -> dict:
@@ -234,4 +247,34 @@ class Discovery:
             uid: info
             for uid, info in self.peers.items()
             if info['ip'] not in self.local_ips
-        }
\ No newline at end of file
+        }
+
+    # Retorna la información de un peer activo, o None si no existe o es local
+    # Consulta directa: evita reconstruir el mapa de get_peers() en cada envío
+    def get_peer(self, uid: bytes):
+        info = self.peers.get(uid)
+        if info is None or info['ip'] in self.local_ips:
+            return None
+        return info
+
+    # Itera los peers activos con su ID ya decodificado
+    # Devuelve tuplas (nombre, id_con_padding, info); cada ID se decodifica una sola vez
+    def iter_peer_ids_decoded(self):
+        for uid, info in self.get_peers().items():
+            name, uid_bytes = self._decode_peer_id(uid)
+            yield name, uid_bytes, info
+
+    # Normaliza una clave de peer (bytes con padding o str cargado del disco)
+    # a su nombre legible y su ID de 20 bytes, memoizando el resultado
+    def _decode_peer_id(self, uid):
+        cached = self._decoded_ids.get(uid)
+        if cached is None:
+            if isinstance(uid, bytes):
+                trimmed = uid.rstrip(b'\x00')
+                name = trimmed.decode('utf-8', errors='ignore')
+            else:
+                name = uid
+                trimmed = name.encode('utf-8')[:20]
+            cached = (name, trimmed.ljust(20, b'\x00'))
+            self._decoded_ids[uid] = cached
+        return cached
@@ -2,6 +2,7 @@
 # Coordina descubrimiento de peers, mensajería y persistencia
 # Gestiona información de peers y ciclo de vida de los hilos
 
+import atexit
 import threading
 import os
 import sys
@@ -75,3 +76,12 @@ class Engine:
             daemon=True  # El hilo se cerrará cuando el programa principal termine
         )
         recv_thread.start()
+
+        # Los recursos se liberan al terminar el proceso
+        atexit.register(self.stop)
+
+    # Detiene los componentes del motor
+    # Cierra el socket TCP y los pools de mensajería para que el puerto
+    # quede libre y no se acepten más transferencias
+    def stop(self):
+        self.messaging.close()
@@ -4,18 +4,26 @@
 # Gestiona comunicación entre peers: mensajes UDP y transferencia de archivos TCP
 # Incluye manejo de reintentos, timeouts y confirmaciones
 
+import logging
 import threading
 import socket
 import os
 from datetime import datetime, UTC
 import queue
+import collections
+import itertools
 import time
-import hashlib
+import mmap
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+import sys
 
+from core.batch_recv import BatchReceiver
 from core.protocol import (
     UDP_PORT,
     BROADCAST_UID,
-    pack_header,
+    HEADER_STRUCT,
+    BODY_ID_STRUCT,
     unpack_header,
     pack_response,
     unpack_response,
@@ -27,20 +35,149 @@ from core.protocol import (
     OP_MESSAGE,
     OP_FILE,
     RESP_OK,
+    RESP_BAD_REQUEST,
+    RESP_INTERNAL_ERROR,
     USER_ID_SIZE
 )
 
+# Logger del módulo: el detalle por paquete solo se emite en nivel DEBUG
+log = logging.getLogger(__name__)
+
+# Tamaño de bloque para lecturas de archivo y de socket (32KB)
+CHUNK_SIZE = 32768
+
+# Bytes iniciales de un archivo entrante usados para detectar su tipo
+SNIFF_SIZE = 8192
+
+# Bloque de recepción/escritura para archivos recibidos (1MB)
+FILE_WRITE_BUFFER = 1 << 20
+
+# Paquetes de descubrimiento pendientes como máximo
+DISCOVERY_QUEUE_MAX = 1024
+
+# Mensajes de texto pendientes de guardar como máximo
+MESSAGE_QUEUE_MAX = 1024
+
+# Tiempo máximo de espera del cuerpo tras confirmar un header (segundos)
+BODY_TIMEOUT = 5.0
+
+# Tiempo máximo de inactividad en una conexión TCP entrante (segundos)
+TCP_TRANSFER_TIMEOUT = 30.0
+
+# Vida máxima de un header de archivo sin conexión TCP y
+# cada cuánto se revisan (segundos)
+PENDING_HEADER_TTL = 30.0
+HEADER_SWEEP_INTERVAL = 5.0
+
+# Intentos de conexión TCP del emisor y espera base entre ellos (segundos)
+CONNECT_RETRIES = 3
+CONNECT_BACKOFF = 0.05
+
+# Buffers del socket UDP compartido (8MB recepción, 2MB envío)
+# Absorben ráfagas de discovery y mensajes sin descartar datagramas;
+# el kernel los limita a net.core.rmem_max / wmem_max
+UDP_RCVBUF = 8 << 20
+UDP_SNDBUF = 2 << 20
+
+# Firmas de archivos comunes (magic numbers) y su extensión
+# Se revisan en orden: las más específicas van antes que sus prefijos (PK)
+_FILE_SIGNATURES = (
+    # Documentos
+    (b'%PDF', '.pdf'),
+    (b'\x50\x4B\x03\x04', '.docx'),  # También puede ser .xlsx, .pptx, .zip
+    (bytes([0xD0, 0xCF, 0x11, 0xE0]), '.doc'),  # Archivos antiguos de Office
+
+    # Imágenes
+    (b'\xFF\xD8\xFF', '.jpg'),
+    (b'\x89PNG\r\n\x1A\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+
+    # Texto y código
+    (b'<!DOCTYPE html', '.html'),
+    (b'<html', '.html'),
+    (b'<?xml', '.xml'),
+    (b'{\n', '.json'),  # Común en archivos JSON
+    (b'{\r\n', '.json'),
+
+    # Comprimidos
+    (b'\x1F\x8B\x08', '.gz'),
+    (b'PK', '.zip'),
+    (b'Rar!', '.rar'),
+
+    # Python
+    (b'#!/usr/bin/env python', '.py'),
+    (b'# -*- coding', '.py'),
+)
+_SIGNATURE_PREFIXES = tuple(signature for signature, _ in _FILE_SIGNATURES)
+
+# Bytes que aparecen en texto (sin importar la codificación)
+_TEXT_CHARS = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+
+# Clave de _acks para un destinatario: su ID sin padding nulo
+# Los IDs de peers son pocos y estables, así que se memoiza el resultado
+@lru_cache(maxsize=256)
+def _ack_key(uid: bytes) -> bytes:
+    return uid.rstrip(b'\x00')
+
+# Nombre legible de un peer a partir de su ID ya sin padding
+# Se repite en cada mensaje del mismo peer, así que también se memoiza
+@lru_cache(maxsize=256)
+def _peer_name(uid: bytes) -> str:
+    return uid.decode('utf-8', errors='ignore')
+
+# Crea un archivo nuevo en directory y devuelve (descriptor crudo, nombre)
+# O_EXCL hace que comprobar y crear sean una sola operación atómica: si el
+# nombre ya existe se prueba con un sufijo numérico, sin pisar otro archivo
+def _create_unique(directory: str, base: str, ext: str):
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    filename = f"{base}{ext}"
+    counter = 0
+    while True:
+        try:
+            return os.open(os.path.join(directory, filename), flags, 0o644), filename
+        except FileExistsError:
+            counter += 1
+            filename = f"{base}_{counter}{ext}"
+
+# Escribe todos los bytes en un descriptor (os.write puede ser parcial)
+def _write_all(fd: int, data):
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+# Indica al kernel que no conserve en caché las páginas de un archivo recibido
+# Inicia su escritura a disco y evita desplazar datos más útiles de la caché
+def _drop_cached_pages(fd: int):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
 # Gestiona mensajería entre peers mediante protocolo LCP
 # Maneja mensajes/archivos con entrega confiable
 class Messaging:
     # Inicializa el sistema de mensajería
-    def __init__(self, user_id: bytes, discovery, history_store):
+    def __init__(self, user_id: bytes, discovery, history_store, tcp_workers: int = 16, send_workers: int = 8):
         # Normaliza ID a 20 bytes con padding
         if isinstance(user_id, str):
             user_id = user_id.encode('utf-8')
         self.raw_id = user_id.rstrip(b'\x00')[:USER_ID_SIZE]
         self.user_id = self.raw_id.ljust(USER_ID_SIZE, b'\x00')
+        # ID sin padding ni espacios, usado para comparar destinatarios
+        self._my_id_key = self.raw_id.rstrip(b' ')
+        # Nuestro ID como texto, usado en cada entrada del historial
+        self._me_str = self._my_id_key.decode('utf-8', errors='ignore')
         print(f"ID inicializado: raw={self.raw_id!r}, padded={self.user_id!r}")
+
+        # Empaquetador de cabeceras con nuestro ID ya fijado como remitente
+        # Uso: self._pack_header(user_to, op_code, body_id, body_len)
+        self._pack_header = partial(HEADER_STRUCT.pack, self.user_id)
+
+        # Respuestas precalculadas: solo dependen del estado y de nuestro ID
+        self._ack_ok = pack_response(RESP_OK, self.user_id)
+        self._ack_bad = pack_response(RESP_BAD_REQUEST, self.user_id)
+        self._ack_err = pack_response(RESP_INTERNAL_ERROR, self.user_id)
         self.discovery = discovery
         self.history_store = history_store
 
@@ -50,9 +187,17 @@ class Messaging:
         self.sock.setblocking(True)
         self.sock.settimeout(5.0)  # Timeout estándar de 5 segundos
         
-        # Optimiza buffers (256KB)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 262144)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 262144)
+        # Buffers amplios: la recepción es por lotes y las ráfagas no deben perderse
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UDP_SNDBUF)
+        # El kernel recorta en silencio lo pedido (net.core.rmem_max en Linux)
+        effective = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if sys.platform.startswith('linux'):
+            effective //= 2  # Linux reporta el doble (incluye su contabilidad interna)
+        if effective < UDP_RCVBUF:
+            log.warning("SO_RCVBUF limitado a %d bytes (pedido %d); "
+                        "aumente net.core.rmem_max para evitar pérdidas en ráfagas",
+                        effective, UDP_RCVBUF)
 
         # Socket TCP para transferencia de archivos
         self.tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -60,41 +205,89 @@ class Messaging:
         self.tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 262144)
         self.tcp_sock.bind(('0.0.0.0', TCP_PORT))
         self.tcp_sock.listen(5)
+
+        # Pool acotado de hilos para transferencias TCP entrantes
+        # Reutiliza hilos y limita cuántas conexiones se atienden a la vez
+        self._tcp_pool = ThreadPoolExecutor(
+            max_workers=tcp_workers,
+            thread_name_prefix='lcp-tcp'
+        )
+
+        # Pool para envíos UDP concurrentes (difusión a varios peers)
+        # Cada peer tiene su propia entrada en _acks, por lo que no colisionan
+        self._send_pool = ThreadPoolExecutor(
+            max_workers=send_workers,
+            thread_name_prefix='lcp-send'
+        )
         
+        # Directorio de descargas: se crea una sola vez al iniciar
+        self._downloads_dir = os.path.join(os.getcwd(), "Descargas")
+        os.makedirs(self._downloads_dir, exist_ok=True)
+
         # Sistema de confirmaciones (ACKs)
+        # El ACK solo identifica al remitente: cada intercambio con un mismo
+        # destinatario toma su lock (_peer_lock) para que ninguno pise el evento
+        # de otro. Las operaciones sueltas sobre los dicts son atómicas
         self._acks = {}             # Mapeo uid→evento
-        self._acks_lock = threading.Lock()
+        self._ack_locks = {}        # Mapeo uid→lock de envío
         
         # IDs de mensajes (0-255)
-        self._next_body_id = 0
-        self._body_id_lock = threading.Lock()
+        # next() sobre itertools.count es una sola llamada en C, atómica con el GIL
+        self._body_ids = itertools.count()
         
+        # Cuerpos de mensaje esperados: IP→(header, plazo monotónico, dirección)
+        # Se indexa por IP: el cuerpo puede llegar desde otro puerto de origen
+        # Solo lo usa el hilo de recv_loop
+        self._pending_bodies = {}
+
+        # Receptor UDP por lotes (recvmmsg en Linux, recvfrom_into en el resto)
+        self._receiver = BatchReceiver(self.sock)
+
         # Control de transferencias pendientes
-        self._pending_headers = {}  # Mapeo body_id→(header,timestamp)
+        self._pending_headers = {}  # Mapeo body_id→(header,instante monotónico)
         self._pending_headers_lock = threading.Lock()
         
         # Cola de mensajes entrantes para procesamiento asíncrono
-        self._message_queue = queue.Queue()
+        # Acotada: si el historial no da abasto, recv_loop espera en lugar de
+        # acumular cuerpos sin límite (ver _handle_body)
+        self._message_queue = queue.Queue(maxsize=MESSAGE_QUEUE_MAX)
+        
+        # Cola de paquetes de descubrimiento (Echo-Request y respuestas no esperadas)
+        # Se atienden fuera de recv_loop para que los ACKs y cuerpos no esperen
+        # tras ellos. deque acotada: ante sobrecarga se descartan los más antiguos,
+        # que de todos modos se repiten en el siguiente broadcast
+        self._discovery_queue = collections.deque(maxlen=DISCOVERY_QUEUE_MAX)
+        self._discovery_ready = threading.Semaphore(0)
+
+        # Indica que close() fue llamado; detiene el bucle de aceptación TCP
+        self._closed = False
+        
+        # Próxima revisión de headers caducados (la hace recv_loop)
+        self._next_header_sweep = 0.0
         
         # Inicio de hilos de mantenimiento
-        # Limpieza de headers antiguos y procesamiento de mensajes
-        threading.Thread(target=self._clean_pending_headers, daemon=True).start()
+        # Procesamiento de mensajes y descubrimiento
         threading.Thread(target=self._process_messages, daemon=True).start()
+        threading.Thread(target=self._process_discovery, daemon=True).start()
 
     # Limpieza periódica de headers pendientes
     # Esta función es importante porque:
     # 1. Evita acumulación de memoria
     # 2. Elimina headers obsoletos
-    # 3. Mantiene el sistema limpio
-    def _clean_pending_headers(self):
-        while True:
-            now = datetime.now(UTC)
-            with self._pending_headers_lock:
-                for body_id in list(self._pending_headers.keys()):
-                    header, timestamp = self._pending_headers[body_id]
-                    if (now - timestamp).total_seconds() > 30:
-                        del self._pending_headers[body_id]
-            threading.Event().wait(5)  # Pausa entre ciclos de limpieza
+    # 3. No necesita hilo propio: recv_loop la invoca al menos cada timeout
+    #    del socket y no hace nada si no hay headers o no toca revisar
+    def _expire_pending_headers(self):
+        if not self._pending_headers:
+            return
+        now = time.monotonic()
+        if now < self._next_header_sweep:
+            return
+        self._next_header_sweep = now + HEADER_SWEEP_INTERVAL
+        with self._pending_headers_lock:
+            for body_id in list(self._pending_headers.keys()):
+                header, timestamp = self._pending_headers[body_id]
+                if now - timestamp > PENDING_HEADER_TTL:
+                    del self._pending_headers[body_id]
 
     # Genera un ID único para el cuerpo del mensaje
     # Esta función es crítica porque:
@@ -102,50 +295,45 @@ class Messaging:
     # 2. Mantiene el contador en rango válido
     # 3. Es thread-safe para uso concurrente
     def _get_next_body_id(self):
-        with self._body_id_lock:
-            body_id = self._next_body_id
-            self._next_body_id = (self._next_body_id + 1) % 256  # Mantiene el ID en 1 byte
-            return body_id
+        return next(self._body_ids) & 0xFF  # Mantiene el ID en 1 byte
 
     # Envía datos y espera confirmación con reintentos
     # Esta función es fundamental porque:
     # 1. Implementa el mecanismo de confirmación
     # 2. Maneja reintentos y timeouts
     # 3. Garantiza la entrega confiable
-    def _send_and_wait(self, data: bytes, recipient: bytes, timeout: float = 5.0, retries: int = 3):
+    # dest permite al llamador reutilizar una dirección ya resuelta
+    def _send_and_wait(self, data: bytes, recipient: bytes, timeout: float = 5.0,
+                       retries: int = 3, dest: tuple = None):
         # Verificación del peer en el sistema de descubrimiento
-        info = self.discovery.get_peers().get(recipient)
-        if not info:
-            raise ValueError("Peer no encontrado en discovery")
-        dest = (info['ip'], UDP_PORT)
+        if dest is None:
+            dest = self._resolve_dest(recipient)
 
         # Preparación del evento de confirmación
+        # Se registra una sola vez y sirve para todos los reintentos:
+        # el llamador retiene el lock del destinatario (_peer_lock)
         ev = threading.Event()
-        key = recipient.rstrip(b'\x00')
-        
-        # Ciclo de reintentos de envío
-        for attempt in range(retries):
-            with self._acks_lock:
-                self._acks[key] = ev
-            
-            try:
-                self.sock.sendto(data, dest)
-                received = ev.wait(timeout)
-                
-                if received:
-                    return True
-                    
-            except socket.error as e:
-                if attempt == retries - 1:
-                    raise ConnectionError(f"Error de red al enviar a {recipient!r}: {e}")
-            finally:
-                with self._acks_lock:
-                    self._acks.pop(key, None)
-                    
-            # Espera exponencial entre reintentos
-            if attempt < retries - 1:
-                threading.Event().wait(0.5 * (attempt + 1))
-                
+        key = _ack_key(recipient)
+        self._acks[key] = ev
+        try:
+            # Ciclo de reintentos de envío
+            for attempt in range(retries):
+                try:
+                    self.sock.sendto(data, dest)
+                    if ev.wait(timeout):
+                        return True
+                except socket.error as e:
+                    if attempt == retries - 1:
+                        raise ConnectionError(f"Error de red al enviar a {recipient!r}: {e}")
+
+                # Espera exponencial entre reintentos
+                if attempt < retries - 1:
+                    time.sleep(0.5 * (attempt + 1))
+        finally:
+            # Solo se retira si sigue siendo nuestro evento
+            if self._acks.get(key) is ev:
+                self._acks.pop(key, None)
+
         raise TimeoutError(f"No se recibió ACK de {recipient!r} después de {retries} intentos")
 
     # Envía un mensaje de texto a un peer específico
@@ -157,126 +345,221 @@ class Messaging:
         # Preparación del mensaje y su identificador
         body_id = self._get_next_body_id()
         body = pack_message_body(body_id, message)
-        
-        # Construcción y envío del header
-        header = pack_header(
-            user_from=self.user_id,
-            user_to=recipient,
-            op_code=OP_MESSAGE,
-            body_id=body_id,
-            body_len=len(body)
-        )
         try:
-            self._send_and_wait(header, recipient, timeout)
-            self._send_and_wait(body, recipient, timeout)
+            self._send_header_then_body(recipient, body_id, body, timeout)
         except (TimeoutError, ConnectionError) as e:
             # Intento de redescubrimiento antes de fallar
             self.discovery.discover_peers()
             raise
 
+    # Ejecuta la secuencia header-ACK-body-ACK con un cuerpo ya empaquetado
+    # Permite reutilizar el mismo cuerpo para varios destinatarios
+    def _send_header_then_body(self, recipient: bytes, body_id: int, body: bytes,
+                               timeout: float = 5.0, dest: tuple = None):
+        # La dirección se resuelve una sola vez para header y cuerpo
+        if dest is None:
+            dest = self._resolve_dest(recipient)
+
+        # Construcción y envío del header
+        header = self._pack_header(recipient, OP_MESSAGE, body_id, len(body))
+        # El receptor espera el cuerpo de un solo header por IP: otro envío
+        # al mismo peer no puede colarse entre nuestro header y su cuerpo
+        with self._peer_lock(recipient):
+            self._send_and_wait(header, recipient, timeout, dest=dest)
+            self._send_and_wait(body, recipient, timeout, dest=dest)
+
+    # Lock de envío de un destinatario
+    # Serializa los intercambios con un mismo peer: el ACK solo lo identifica
+    # a él, así que dos esperas simultáneas no se podrían distinguir
+    def _peer_lock(self, recipient: bytes) -> threading.Lock:
+        key = _ack_key(recipient)
+        return self._ack_locks.get(key) or self._ack_locks.setdefault(key, threading.Lock())
+
+    # Obtiene la dirección UDP de un peer registrado en discovery
+    def _resolve_dest(self, recipient: bytes) -> tuple:
+        info = self.discovery.get_peer(recipient)
+        if not info:
+            raise ValueError("Peer no encontrado en discovery")
+        return (info['ip'], UDP_PORT)
+
     # Envía un archivo a un peer específico usando TCP
     # Esta función es crítica porque:
     # 1. Maneja transferencias grandes eficientemente
     # 2. Implementa el protocolo de archivos
     # 3. Coordina UDP (control) y TCP (datos)
     def send_file(self, recipient: bytes, file_bytes: bytes, filename: str, timeout: float = None):
+        # sendall sobre un memoryview evita crear un bytes por chunk
+        self._transfer_file(recipient, filename, len(file_bytes),
+                            lambda sock: sock.sendall(memoryview(file_bytes)), timeout)
+
+    # Envía a un peer un archivo que está en disco
+    # El contenido no se carga en memoria: se transmite desde el archivo
+    def send_file_path(self, recipient: bytes, path, filename: str, timeout: float = None):
+        file_size = os.path.getsize(path)
+        self._transfer_file(recipient, filename, file_size,
+                            lambda sock: self._send_path(sock, path, file_size), timeout)
+
+    # Ejecuta el protocolo de archivos: header UDP con ACK, conexión TCP,
+    # ID del archivo, contenido (escrito por send_body) y ACK final
+    def _transfer_file(self, recipient: bytes, filename: str, file_size: int,
+                       send_body, timeout: float = None):
         # Verificación del peer destino
-        info = self.discovery.get_peers().get(recipient)
+        info = self.discovery.get_peer(recipient)
         if not info:
             raise ValueError("Peer no encontrado en discovery")
-            
+
         # Preparación del identificador y datos del archivo
         body_id = self._get_next_body_id()
-        print(f"Enviando archivo {filename} (body_id={body_id})")
+        log.info("Enviando archivo %s (body_id=%d)", filename, body_id)
         
         # Preparación y envío del header UDP
         # Según protocolo: BodyLength es el tamaño del archivo
-        header = pack_header(
-            user_from=self.user_id,
-            user_to=recipient,
-            op_code=OP_FILE,
-            body_id=body_id,
-            body_len=len(file_bytes)  # Tamaño total del archivo
-        )
+        header = self._pack_header(recipient, OP_FILE, body_id, file_size)
         
         try:
             # Envío del header y espera de confirmación
-            self._send_and_wait(header, recipient, timeout or 5.0)
-            print(f"Header UDP enviado, esperando ACK...")
-            
-            # Pausa para sincronización con receptor
-            time.sleep(0.5)
+            with self._peer_lock(recipient):
+                self._send_and_wait(header, recipient, timeout or 5.0, dest=(info['ip'], UDP_PORT))
+            log.debug("Header UDP confirmado")
             
+            # Sin pausa: el receptor registra el header antes de enviar el ACK
+            # y su socket TCP escucha desde el inicio
             # Establecimiento de conexión TCP y transferencia
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                # Configuración del socket para transferencia eficiente
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 262144)  # Buffer optimizado
-                sock.settimeout(timeout or 30.0)
-                
-                print(f"Conectando a {info['ip']}:{TCP_PORT}...")
-                sock.connect((info['ip'], TCP_PORT))
-                
+            log.debug("Conectando a %s:%d...", info['ip'], TCP_PORT)
+            with self._connect_with_retry((info['ip'], TCP_PORT), timeout or 30.0) as sock:
                 # Envío del ID del archivo (8 bytes)
-                file_id_bytes = body_id.to_bytes(8, 'big')
-                sock.send(file_id_bytes)
+                # Con TCP_NODELAY saldría solo en un segmento diminuto: MSG_MORE
+                # (Linux) lo retiene para que viaje junto al inicio del contenido
+                file_id_bytes = BODY_ID_STRUCT.pack(body_id)
+                more = getattr(socket, 'MSG_MORE', 0) if file_size else 0
+                sock.sendall(file_id_bytes, more)
                 
-                # Transferencia del archivo en chunks para eficiencia
-                sent = 0
-                chunk_size = 32768  # 32KB
-                while sent < len(file_bytes):
-                    chunk = file_bytes[sent:sent + chunk_size]
-                    bytes_sent = sock.send(chunk)
-                    if bytes_sent == 0:
-                        raise ConnectionError("Conexión cerrada durante envío")
-                    sent += bytes_sent
-                    print(f"Enviados {sent}/{len(file_bytes)} bytes")
+                # Transferencia del contenido sin copias intermedias
+                send_body(sock)
+                log.debug("Enviados %d bytes", file_size)
                 
                 # Finalización de la transferencia y espera de confirmación
-                print("Esperando ACK final...")
+                log.debug("Esperando ACK final...")
                 sock.shutdown(socket.SHUT_WR)  # Señalización de fin de datos
                 
                 # Recepción de confirmación con timeout
                 sock.settimeout(5.0)  # Timeout específico para ACK
-                ack = sock.recv(RESPONSE_SIZE)
-                if not ack or len(ack) != RESPONSE_SIZE:
-                    raise ConnectionError(f"ACK inválido: recibidos {len(ack) if ack else 0} bytes")
+                # TCP puede entregar los 25 bytes en varias lecturas
+                ack = bytearray(RESPONSE_SIZE)
+                ack_view = memoryview(ack)
+                received = 0
+                while received < RESPONSE_SIZE:
+                    count = sock.recv_into(ack_view[received:])
+                    if not count:
+                        break
+                    received += count
+                if received != RESPONSE_SIZE:
+                    raise ConnectionError(f"ACK inválido: recibidos {received} bytes")
                     
                 try:
                     # Procesamiento de la confirmación
                     resp = unpack_response(ack)
-                    print(f"ACK recibido: status={resp['status']}, responder={resp['responder']!r}")
+                    log.debug("ACK recibido: status=%d, responder=%r", resp.status, resp.responder)
                     
                     # Manejo de diferentes estados de respuesta
-                    if resp['status'] == RESP_OK:
-                        print("Archivo enviado correctamente")
-                    elif resp['status'] == 1:  # Archivo existente
-                        print("El archivo ya existe en el destino")
-                    elif resp['status'] == 2:  # Error interno
+                    if resp.status == RESP_OK:
+                        log.info("Archivo enviado correctamente")
+                    elif resp.status == 1:  # Archivo existente
+                        log.info("El archivo ya existe en el destino")
+                    elif resp.status == 2:  # Error interno
                         raise ConnectionError("Error general en el receptor")
                     else:
-                        raise ConnectionError(f"Estado de ACK desconocido: {resp['status']}")
+                        raise ConnectionError(f"Estado de ACK desconocido: {resp.status}")
                         
                 except Exception as e:
-                    print(f"Error decodificando ACK: {e}")
-                    print(f"Bytes recibidos: {' '.join(f'{b:02x}' for b in ack)}")
+                    log.error("Error decodificando ACK: %s (bytes: %s)", e, ack.hex(' '))
                     raise
                     
         except Exception as e:
-            print(f"Error en transferencia TCP: {e}")
+            log.error("Error en transferencia TCP: %s", e)
             raise
 
+    # Abre la conexión TCP de una transferencia reintentando si es rechazada
+    # Cubre el caso raro de que el receptor aún no esté aceptando conexiones
+    # Cada intento usa un socket nuevo: repetir connect() sobre uno que ya
+    # falló solo funciona en Linux (BSD/macOS devuelven EINVAL)
+    def _connect_with_retry(self, dest: tuple, timeout: float) -> socket.socket:
+        for attempt in range(CONNECT_RETRIES):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                # Configuración del socket para transferencia eficiente
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 262144)  # Buffer optimizado
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Sin retardo de Nagle
+                sock.settimeout(timeout)
+                sock.connect(dest)
+                return sock
+            except ConnectionRefusedError:
+                sock.close()
+                if attempt == CONNECT_RETRIES - 1:
+                    raise
+                time.sleep(CONNECT_BACKOFF * (attempt + 1))
+            except BaseException:
+                sock.close()
+                raise
+
+    # Envía un archivo en disco sin cargarlo en el heap de Python
+    # Con os.sendfile el kernel copia directamente de la caché al socket;
+    # donde no existe, se mapea el archivo y se leen las páginas bajo demanda
+    def _send_path(self, sock: socket.socket, path, file_size: int):
+        if file_size == 0:
+            return
+        with open(path, 'rb') as f:
+            if hasattr(os, 'sendfile'):
+                # Lectura secuencial: duplica la lectura anticipada del kernel
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                sock.sendfile(f, 0, file_size)
+                return
+            # En plataformas de 32 bits no se puede mapear más de 2 GiB
+            if sys.maxsize <= 2**32 and file_size > 2**31 - 1:
+                while chunk := f.read(CHUNK_SIZE):
+                    sock.sendall(chunk)
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Lectura secuencial: el kernel adelanta páginas y libera las ya leídas
+                if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mm) as view:
+                    sock.sendall(view)
+
     # Envía un mensaje a todos los peers excepto broadcast
     # Esta función es importante porque:
-    # 1. Maneja la difusión de mensajes
-    # 2. Ignora fallos individuales
-    # 3. Excluye el UID de broadcast
+    # 1. Empaqueta el cuerpo una sola vez para todos los peers
+    # 2. Envía a cada peer en paralelo (tiempo total ~ el peer más lento)
+    # 3. Ignora fallos individuales
     def broadcast(self, message: bytes):
-        for peer_id in self.discovery.get_peers():
-            if peer_id == BROADCAST_UID:
-                continue
+        # Una sola instantánea de peers: cada envío recibe su dirección ya resuelta
+        peers = [
+            (pid, (info['ip'], UDP_PORT))
+            for pid, info in self.discovery.get_peers().items()
+            if pid != BROADCAST_UID
+        ]
+        if not peers:
+            return
+
+        # El contenido es idéntico para todos: solo cambia el destinatario del header
+        body_id = self._get_next_body_id()
+        body = pack_message_body(body_id, message)
+
+        # Tras close() el pool ya no acepta tareas: no hay nada que enviar
+        if self._closed:
+            return
+        try:
+            futures = [
+                self._send_pool.submit(self._send_header_then_body, peer_id, body_id, body, dest=dest)
+                for peer_id, dest in peers
+            ]
+        except RuntimeError:
+            return
+        for future in futures:
             try:
-                self.send(peer_id, message)
-            except:
+                future.result()
+            except Exception:
                 pass
 
     # Alias para envío de mensajes globales
@@ -289,24 +572,77 @@ class Messaging:
     def start_listening(self):
         threading.Thread(target=self.recv_loop, daemon=True).start()
 
+    # Libera los recursos propios de la mensajería
+    # Los pools se cierran sin esperar: las tareas en curso terminan solas
+    # y sus hilos no bloquean la salida. El socket UDP pertenece a discovery
+    # close() por sí solo no despierta a un accept() bloqueado: shutdown()
+    # lo hace fallar antes de liberar el descriptor
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.tcp_sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.tcp_sock.close()
+        except OSError:
+            pass
+        self._tcp_pool.shutdown(wait=False)
+        self._send_pool.shutdown(wait=False)
+
     # Procesa mensajes de la cola en segundo plano
     # Esta función es crítica porque:
     # 1. Maneja mensajes de forma asíncrona
     # 2. Evita bloqueos en el receptor
     # 3. Aísla errores de procesamiento
+    # Los mensajes ya encolados se procesan en lote y se guardan
+    # en el historial con una única escritura
     def _process_messages(self):
         while True:
             try:
-                hdr, body = self._message_queue.get()
-                self._handle_message_or_file(hdr, body)
+                batch = [self._message_queue.get()]
+                while True:
+                    try:
+                        batch.append(self._message_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                entries = []
+                for hdr, body, arrived in batch:
+                    entry = self._handle_message_or_file(hdr, body, arrived)
+                    if entry:
+                        entries.append(entry)
+                self.history_store.append_messages(entries)
+            except Exception as e:
+                log.error("Error procesando mensaje de la cola: %s", e)
+
+    # Encola un paquete de descubrimiento para el hilo de discovery
+    # deque.append es atómico: recv_loop no toma ningún lock
+    def _defer_discovery(self, handler, data, addr):
+        # Copia: el buffer de recepción se reutiliza en la siguiente lectura
+        self._discovery_queue.append((handler, bytes(data), addr))
+        self._discovery_ready.release()
+
+    # Atiende los paquetes de descubrimiento encolados por recv_loop
+    def _process_discovery(self):
+        while True:
+            self._discovery_ready.acquire()
+            try:
+                handler, data, addr = self._discovery_queue.popleft()
+            except IndexError:
+                continue  # El elemento fue descartado por desbordamiento
+            try:
+                handler(data, addr)
             except Exception as e:
-                print(f"Error procesando mensaje de la cola: {e}")
+                log.error("Error procesando paquete de descubrimiento: %s", e)
 
     # Bucle principal de recepción de mensajes
     # Esta función es fundamental porque:
-    # 1. Maneja todos los tipos de mensajes
+    # 1. Recibe datagramas por lotes (recvmmsg en Linux)
     # 2. Coordina TCP y UDP
-    # 3. Procesa confirmaciones
+    # 3. Despacha cada datagrama sin bloquear esperando cuerpos
     def recv_loop(self):
         print("Iniciando loop de recepción de mensajes...")
         
@@ -314,163 +650,200 @@ class Messaging:
         tcp_thread = threading.Thread(target=self._tcp_accept_loop, daemon=True)
         tcp_thread.start()
         
-        while True:
+        # Tras close() termina en el siguiente timeout del socket
+        while not self._closed:
+            try:
+                # Recepción de datos UDP (uno o varios datagramas por llamada)
+                # Cada datagrama es una vista sobre el buffer del receptor,
+                # con su instante de llegada en ns
+                for data, addr, arrived in self._receiver.recv():
+                    self._dispatch_datagram(data, addr, arrived)
+            except socket.timeout:
+                pass  # Timeout normal, continuar escuchando
+            except Exception as e:
+                log.error("Error en recv_loop: %s", e)
+            self._expire_pending_bodies()
+            self._expire_pending_headers()
+
+    # Procesa un datagrama UDP recibido
+    # Los cuerpos de mensaje se reconocen por el estado pendiente de su emisor:
+    # tras el ACK del header, el siguiente datagrama de esa dirección es el cuerpo
+    # data es una memoryview válida solo durante esta llamada: lo que se
+    # guarde para más tarde (cuerpos, paquetes de discovery) se copia
+    def _dispatch_datagram(self, data: memoryview, addr, arrived: int):
+        log.debug("Recibidos %d bytes desde %s", len(data), addr[0])
+        
+        # Validación básica del paquete
+        if len(data) < 1:
+            log.debug("  - Paquete vacío, ignorando")
+            return
+
+        # Cuerpo de un mensaje cuyo header ya fue confirmado
+        # Un ACK o header del mismo peer (por un envío suyo en curso) puede
+        # medir lo mismo que el cuerpo: con esas longitudes se exige además
+        # que los primeros 8 bytes sean el body_id anunciado
+        pending = self._pending_bodies.get(addr[0])
+        if pending and (len(data) not in (RESPONSE_SIZE, HEADER_SIZE)
+                        or (len(data) == pending[0].body_len
+                            and BODY_ID_STRUCT.unpack_from(data)[0] == pending[0].body_id)):
+            del self._pending_bodies[addr[0]]
+            self._handle_body(pending[0], data, addr, arrived)
+            return
+
+        # Procesamiento de confirmaciones (ACKs)
+        if len(data) == RESPONSE_SIZE:
             try:
-                # Recepción de datos UDP
-                data, addr = self.sock.recvfrom(4096)
-                print(f"\nRecibidos {len(data)} bytes desde {addr[0]}")
+                resp = unpack_response(data)
+                log.debug("  - Es un ACK (status=%d)", resp.status)
+                if resp.status == 0:
+                    r = resp.responder  # unpack_response ya elimina el padding
+                    ev = self._acks.get(r)
+                    if ev:
+                        log.debug("  - ACK esperado de %r, notificando", r)
+                        ev.set()
+                        return
+                    else:
+                        log.debug("  - ACK no esperado de %r", r)
+                self._defer_discovery(self.discovery.handle_response, data, addr)
+            except Exception as e:
+                log.warning("Error procesando ACK: %s", e)
+            return
+
+        # Procesamiento de mensajes y archivos
+        if len(data) < HEADER_SIZE:
+            log.debug("  - Paquete demasiado corto para header (%d < %d)", len(data), HEADER_SIZE)
+            return
+
+        try:
+            # Decodificación y validación del header
+            hdr = unpack_header(data)
+            log.debug("  - Header decodificado: op=%d, from=%r, to=%r",
+                      hdr.op_code, hdr.user_from, hdr.user_to)
+        except Exception as e:
+            log.warning("Error desempaquetando header: %s", e)
+            return
+
+        # Manejo de pings de descubrimiento
+        # Los pings son mensajes broadcast con op_code 0
+        if hdr.op_code == 0 and hdr.user_to == BROADCAST_UID:
+            log.debug("  - Es un ping de discovery")
+            self._defer_discovery(self.discovery.handle_echo, data, addr)
+            return
+
+        # Validación de destinatario del mensaje
+        # Determina si el mensaje es para este peer o es broadcast
+        # unpack_header ya elimina el padding nulo; solo quedan espacios
+        my_id = self._my_id_key
+        to_id = hdr.user_to.rstrip(b' ')
+        is_for_me = (to_id == my_id)
+        is_broadcast = (to_id == BROADCAST_UID)
+        
+        # Logging detallado para debugging de IDs (solo con nivel DEBUG activo)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("  - Destino: %s",
+                      'broadcast' if is_broadcast else ('para mí' if is_for_me else 'no es para mí'))
+            log.debug("  - Mi ID: %r, ID destino: %r, ID origen: %r",
+                      my_id, to_id, hdr.user_from)
+        
+        # Procesamiento de mensajes y archivos destinados a este peer
+        if not (hdr.op_code in (OP_MESSAGE, OP_FILE) and (is_for_me or is_broadcast)):
+            log.debug("  - Mensaje ignorado (no es para mí ni broadcast)")
+            return
+
+        try:
+            log.debug("Procesando mensaje de %s tipo %d%s",
+                      addr[0], hdr.op_code, " (broadcast)" if is_broadcast else "")
+            
+            # Registro del header para la transferencia TCP
+            # Se hace antes del ACK: en cuanto el emisor lo recibe se conecta
+            # por TCP, y el header ya tiene que estar disponible
+            if hdr.op_code == OP_FILE and not is_broadcast:
+                with self._pending_headers_lock:
+                    self._pending_headers[hdr.body_id] = (hdr, time.monotonic())
+                log.debug("  - Header guardado para transferencia TCP")
+
+            # Envío de confirmación de recepción de header
+            self.sock.sendto(self._ack_ok, addr)
+            log.debug("  - ACK de header enviado")
+
+            # Manejo de mensajes de texto
+            if hdr.op_code == OP_MESSAGE:
+                # El cuerpo llegará en otro datagrama desde la misma IP
+                deadline = time.monotonic() + BODY_TIMEOUT
+                self._pending_bodies[addr[0]] = (hdr, deadline, addr)
+                log.debug("  - Esperando cuerpo del mensaje (%d bytes)", hdr.body_len)
+                    
+            # Rechazo de archivos broadcast por seguridad
+            elif hdr.op_code == OP_FILE and is_broadcast:
+                log.debug("  - Ignorando archivo broadcast")
+                self.sock.sendto(self._ack_bad, addr)
                 
-                # Validación básica del paquete
-                if len(data) < 1:
-                    print("  - Paquete vacío, ignorando")
-                    continue
+        except Exception as e:
+            log.warning("Error procesando mensaje: %s", e)
+            try:
+                self.sock.sendto(self._ack_err, addr)
+            except:
+                pass
 
-                # Procesamiento de confirmaciones (ACKs)
-                if len(data) == RESPONSE_SIZE:
-                    try:
-                        resp = unpack_response(data)
-                        print(f"  - Es un ACK (status={resp['status']})")
-                        if resp['status'] == 0:
-                            r = resp['responder'].rstrip(b'\x00')
-                            with self._acks_lock:
-                                ev = self._acks.get(r)
-                                if ev:
-                                    print(f"  - ACK esperado de {r!r}, notificando")
-                                    ev.set()
-                                    continue
-                                else:
-                                    print(f"  - ACK no esperado de {r!r}")
-                        self.discovery.handle_response(data, addr)
-                    except Exception as e:
-                        print(f"Error procesando ACK: {e}")
-                    continue
-
-                # Procesamiento de mensajes y archivos
-                if len(data) < HEADER_SIZE:
-                    print(f"  - Paquete demasiado corto para header ({len(data)} < {HEADER_SIZE})")
-                    continue
+    # Confirma y encola el cuerpo de un mensaje de texto
+    # arrived es el instante de llegada del cuerpo (ns), usado en el historial
+    def _handle_body(self, hdr, body: memoryview, addr, arrived: int):
+        log.debug("    - Recibidos %d bytes", len(body))
+        
+        # Validación de integridad del mensaje
+        if len(body) != hdr.body_len:
+            log.warning("Tamaño de cuerpo recibido (%d) != esperado (%d)", len(body), hdr.body_len)
+        
+        # Encolado para procesamiento asíncrono, antes de confirmar
+        # Única copia del cuerpo: el buffer de recepción se reutilizará
+        # Con la cola llena se bloquea: los datagramas esperan en el buffer del
+        # socket y el ACK sale solo cuando el mensaje ya tiene sitio
+        self._message_queue.put((hdr, bytes(body), arrived))
+        log.debug("  - Mensaje encolado para procesamiento")
+        
+        try:
+            # Confirmación de recepción del cuerpo
+            self.sock.sendto(self._ack_ok, addr)
+            log.debug("  - ACK de cuerpo enviado")
+        except Exception as e:
+            log.warning("Error enviando ACK de cuerpo: %s", e)
 
+    # Descarta cuerpos que no llegaron a tiempo y avisa al emisor
+    # Solo se llama desde recv_loop, por lo que no necesita lock
+    def _expire_pending_bodies(self):
+        if not self._pending_bodies:
+            return
+        now = time.monotonic()
+        for ip, (hdr, deadline, addr) in list(self._pending_bodies.items()):
+            if now >= deadline:
+                del self._pending_bodies[ip]
+                log.warning("Timeout recibiendo cuerpo del mensaje de %s", addr[0])
                 try:
-                    # Decodificación y validación del header
-                    hdr = unpack_header(data[:HEADER_SIZE])
-                    print(f"  - Header decodificado: op={hdr['op_code']}, from={hdr['user_from']!r}, to={hdr['user_to']!r}")
-                except Exception as e:
-                    print(f"Error desempaquetando header: {e}")
-                    continue
-
-                # Manejo de pings de descubrimiento
-                # Los pings son mensajes broadcast con op_code 0
-                if hdr['op_code'] == 0 and hdr['user_to'] == BROADCAST_UID:
-                    print("  - Es un ping de discovery")
-                    self.discovery.handle_echo(data, addr)
-                    continue
-
-                # Validación de destinatario del mensaje
-                # Determina si el mensaje es para este peer o es broadcast
-                my_id = self.raw_id.rstrip(b' ')
-                to_id = hdr['user_to'].rstrip(b' ')  # Sin padding nulo
-                from_id = hdr['user_from'].rstrip(b' ')  # Sin padding nulo
-                is_for_me = (to_id == my_id)
-                is_broadcast = (to_id == BROADCAST_UID)
-                
-                # Logging detallado para debugging de IDs
-                print(f"  - Destino: {'broadcast' if is_broadcast else ('para mí' if is_for_me else 'no es para mí')}")
-                print(f"  - Mi ID (sin espacios): {my_id!r}")
-                print(f"  - ID destino (sin espacios): {to_id!r}")
-                print(f"  - ID origen (sin espacios): {from_id!r}")
-                
-                # Procesamiento de mensajes y archivos destinados a este peer
-                if hdr['op_code'] in (OP_MESSAGE, OP_FILE) and (is_for_me or is_broadcast):
-                    try:
-                        print(f"Procesando mensaje de {addr[0]} tipo {hdr['op_code']} {'(broadcast)' if is_broadcast else ''}")
-                        
-                        # Envío de confirmación de recepción de header
-                        self.sock.sendto(pack_response(0, self.user_id), addr)
-                        print("  - ACK de header enviado")
-
-                        # Manejo de mensajes de texto
-                        if hdr['op_code'] == OP_MESSAGE:
-                            # Preparación para recepción del cuerpo
-                            body_len = hdr['body_len']
-                            body = bytearray()
-                            
-                            try:
-                                # Configuración de timeout para el cuerpo
-                                self.sock.settimeout(5.0)
-                                print(f"  - Esperando cuerpo del mensaje ({body_len} bytes)")
-                                
-                                # Recepción del cuerpo completo
-                                # Buffer grande para minimizar fragmentación
-                                chunk, _ = self.sock.recvfrom(65536)  # 64KB
-                                if not chunk:
-                                    raise ConnectionError("Conexión cerrada durante recepción")
-                                    
-                                print(f"    - Recibidos {len(chunk)} bytes")
-                                
-                                # Validación de integridad del mensaje
-                                if len(chunk) != body_len:
-                                    print(f"    - ADVERTENCIA: Tamaño recibido ({len(chunk)}) != esperado ({body_len})")
-                                    
-                                body.extend(chunk)
-                                
-                                # Confirmación de recepción del cuerpo
-                                self.sock.sendto(pack_response(0, self.user_id), addr)
-                                print("  - ACK de cuerpo enviado")
-                                
-                                # Encolado para procesamiento asíncrono
-                                self._message_queue.put((hdr, bytes(body)))
-                                print(f"  - Mensaje encolado para procesamiento")
-                                
-                            except socket.timeout:
-                                print("Timeout recibiendo cuerpo del mensaje")
-                                self.sock.sendto(pack_response(2, self.user_id), addr)
-                            finally:
-                                # Restauración del timeout por defecto
-                                self.sock.settimeout(5.0)
-                                
-                        # Manejo de transferencias de archivos
-                        elif hdr['op_code'] == OP_FILE:
-                            # Rechazo de archivos broadcast por seguridad
-                            if is_broadcast:
-                                print("  - Ignorando archivo broadcast")
-                                self.sock.sendto(pack_response(1, self.user_id), addr)
-                                continue
-                                
-                            # Registro del header para la transferencia TCP
-                            with self._pending_headers_lock:
-                                self._pending_headers[hdr['body_id']] = (hdr, datetime.now(UTC))
-                            print("  - Header guardado para transferencia TCP")
-                            
-                    except Exception as e:
-                        print(f"Error procesando mensaje: {e}")
-                        try:
-                            self.sock.sendto(pack_response(2, self.user_id), addr)
-                        except:
-                            pass
-                else:
-                    print("  - Mensaje ignorado (no es para mí ni broadcast)")
-            except socket.timeout:
-                continue  # Timeout normal, continuar escuchando
-            except Exception as e:
-                print(f"Error en recv_loop: {e}")
-                continue
+                    self.sock.sendto(self._ack_err, addr)
+                except Exception:
+                    pass
 
     # Bucle de aceptación de conexiones TCP para archivos
     # Esta función es crítica porque:
     # 1. Maneja conexiones entrantes de archivos
-    # 2. Crea hilos dedicados por transferencia
+    # 2. Delega cada transferencia al pool de hilos
     # 3. Mantiene el sistema responsive
     def _tcp_accept_loop(self):
-        while True:
+        while not self._closed:
             try:
                 client_sock, addr = self.tcp_sock.accept()
-                threading.Thread(
-                    target=self._handle_tcp_file_transfer,
-                    args=(client_sock, addr),
-                    daemon=True
-                ).start()
+                # Evita que una transferencia bloqueada retenga un hilo del pool
+                client_sock.settimeout(TCP_TRANSFER_TIMEOUT)
+                try:
+                    self._tcp_pool.submit(self._handle_tcp_file_transfer, client_sock, addr)
+                except RuntimeError:
+                    # Pool cerrado por close(): la conexión no se atenderá
+                    client_sock.close()
+                    raise
             except Exception as e:
-                print(f"Error aceptando conexión TCP: {e}")
+                if self._closed:
+                    break
+                log.error("Error aceptando conexión TCP: %s", e)
                 continue
 
     # Sanitiza el nombre del archivo eliminando caracteres no válidos
@@ -503,40 +876,10 @@ class Messaging:
 
     def _detect_file_type(self, data: bytes) -> str:
         """Detecta el tipo de archivo basado en sus bytes iniciales (magic numbers)"""
-        # Diccionario de firmas de archivos comunes
-        signatures = {
-            # Documentos
-            b'%PDF': '.pdf',
-            b'\x50\x4B\x03\x04': '.docx',  # También puede ser .xlsx, .pptx, .zip
-            bytes([0xD0, 0xCF, 0x11, 0xE0]): '.doc',  # Archivos antiguos de Office
-            
-            # Imágenes
-            b'\xFF\xD8\xFF': '.jpg',
-            b'\x89PNG\r\n\x1A\n': '.png',
-            b'GIF87a': '.gif',
-            b'GIF89a': '.gif',
-            b'BM': '.bmp',
-            
-            # Texto y código
-            b'<!DOCTYPE html': '.html',
-            b'<html': '.html',
-            b'<?xml': '.xml',
-            b'{\n': '.json',  # Común en archivos JSON
-            b'{\r\n': '.json',
-            
-            # Comprimidos
-            b'\x1F\x8B\x08': '.gz',
-            b'PK': '.zip',
-            b'Rar!': '.rar',
-            
-            # Python
-            b'#!/usr/bin/env python': '.py',
-            b'# -*- coding': '.py'
-        }
-        
         # Convertir los primeros bytes a texto para detectar archivos de texto
         try:
-            start = data[:min(len(data), 1024)].decode('utf-8')
+            # Se decodifica sobre un memoryview: el recorte no copia los bytes
+            start = str(memoryview(data)[:1024], 'utf-8')
             # Si se puede decodificar como UTF-8 y no tiene caracteres nulos, probablemente es texto
             if '\x00' not in start:
                 return '.txt'
@@ -544,14 +887,15 @@ class Messaging:
             pass
             
         # Revisar firmas conocidas
-        for signature, extension in signatures.items():
-            if data.startswith(signature):
-                return extension
+        # Un solo startswith descarta de golpe los datos sin ninguna firma
+        if data.startswith(_SIGNATURE_PREFIXES):
+            for signature, extension in _FILE_SIGNATURES:
+                if data.startswith(signature):
+                    return extension
                 
         # Si no se reconoce la firma, intentar detectar por contenido
         # Verificar si parece un archivo de texto a pesar de no estar en UTF-8
-        text_chars = bytearray({7,8,9,10,12,13,27} | set(range(0x20, 0x100)) - {0x7f})
-        is_binary = bool(data.translate(None, text_chars))
+        is_binary = bool(data.translate(None, _TEXT_CHARS))
         if not is_binary:
             return '.txt'
             
@@ -565,80 +909,104 @@ class Messaging:
     # 3. Valida la integridad de los datos
     def _handle_tcp_file_transfer(self, sock: socket.socket, addr):
         # Función auxiliar para lectura exacta de bytes
+        # Reserva el buffer completo una vez y lo llena en su lugar con recv_into
         def recv_exact(n):
-            data = bytearray()
-            remaining = n
-            while remaining > 0:
-                chunk = sock.recv(min(32768, remaining))  # Leer en chunks de máximo 32KB
-                if not chunk:
+            data = bytearray(n)
+            view = memoryview(data)
+            received = 0
+            while received < n:
+                count = sock.recv_into(view[received:], min(CHUNK_SIZE, n - received))
+                if not count:
                     raise ConnectionError("Conexión cerrada durante recepción")
-                data.extend(chunk)
-                remaining -= len(chunk)
-            return bytes(data)
+                received += count
+            return data
 
         try:
             # Recepción del identificador del archivo (8 bytes)
-            file_id = int.from_bytes(recv_exact(8), 'big')
-            print(f"ID de archivo recibido: {file_id}")
+            file_id, = BODY_ID_STRUCT.unpack_from(recv_exact(BODY_ID_STRUCT.size))
+            log.debug("ID de archivo recibido: %d", file_id)
             
             # Validación contra headers pendientes
             with self._pending_headers_lock:
                 if file_id not in self._pending_headers:
-                    print(f"No hay header pendiente para file_id={file_id}")
-                    sock.send(pack_response(2, self.user_id))  # Error
+                    log.warning("No hay header pendiente para file_id=%d", file_id)
+                    sock.send(self._ack_err)  # Error
                     return
                     
                 hdr, _ = self._pending_headers[file_id]
                 del self._pending_headers[file_id]  # Limpiar header usado
 
             # Recepción del contenido del archivo
-            body_len = hdr['body_len']
+            body_len = hdr.body_len
             if body_len <= 0:
-                print(f"Tamaño de archivo inválido: {body_len}")
-                sock.send(pack_response(2, self.user_id))
+                log.warning("Tamaño de archivo inválido: %d", body_len)
+                sock.send(self._ack_err)
                 return
 
-            print(f"Iniciando recepción de {body_len} bytes...")
-            body = recv_exact(body_len)  # Usar recv_exact para todo el archivo
-            print(f"Recepción completa: {len(body)} bytes")
+            log.debug("Iniciando recepción de %d bytes...", body_len)
+            # Solo el inicio del archivo se mantiene en memoria, para detectar su tipo;
+            # el resto se escribe a disco a medida que llega
+            head = recv_exact(min(body_len, SNIFF_SIZE))
             
             # Detectar el tipo de archivo
-            extension = self._detect_file_type(body)
-            print(f"Tipo de archivo detectado: {extension}")
-
-            # Preparación del directorio de descargas
-            downloads_dir = os.path.join(os.getcwd(), "Descargas")
-            os.makedirs(downloads_dir, exist_ok=True)
+            extension = self._detect_file_type(head)
+            log.debug("Tipo de archivo detectado: %s", extension)
 
             # Generar nombre de archivo con la extensión correcta
             timestamp = datetime.now(UTC).strftime("%Y%m%d_%H%M%S")
-            filename = f"archivo_{timestamp}_{file_id & 0xFF}{extension}"
-            path = os.path.join(downloads_dir, filename)
+            fd, filename = _create_unique(self._downloads_dir,
+                                          f"archivo_{timestamp}_{file_id & 0xFF}",
+                                          extension)
+            path = os.path.join(self._downloads_dir, filename)
             
-            # Guardar el archivo
-            with open(path, 'wb') as f:
-                f.write(body)
-            print(f"Archivo guardado como {filename}")
+            # Guardar el archivo directamente desde el socket
+            # Descriptor crudo: cada bloque recibido se escribe tal cual con
+            # os.write, sin pasar por el buffer intermedio de un archivo Python
+            try:
+                _write_all(fd, head)
+                # Un único buffer grande reutilizado para todos los bloques
+                buf = memoryview(bytearray(FILE_WRITE_BUFFER))
+                remaining = body_len - len(head)
+                while remaining > 0:
+                    count = sock.recv_into(buf, min(FILE_WRITE_BUFFER, remaining))
+                    if not count:
+                        raise ConnectionError("Conexión cerrada durante recepción")
+                    _write_all(fd, buf[:count])
+                    remaining -= count
+                _drop_cached_pages(fd)
+            except Exception:
+                # No dejar archivos incompletos en Descargas
+                os.close(fd)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                raise
+            os.close(fd)
+            log.info("Archivo guardado como %s (%d bytes)", filename, body_len)
 
             # Enviar confirmación según protocolo
-            sock.send(pack_response(0, self.user_id))
-            print("ACK enviado")
+            sock.send(self._ack_ok)
+            log.debug("ACK enviado")
             
             # Registro en el historial de transferencias
+            # El remitente sale del header UDP ya emparejado por file_id: no
+            # hace falta buscar qué peer tiene la IP de la conexión
             self.history_store.append_file(
-                sender=addr[0],
-                recipient=self.raw_id.decode('utf-8'),
+                sender=_peer_name(hdr.user_from),
+                recipient=self._me_str,
                 filename=filename,
-                timestamp=datetime.now(UTC)
+                timestamp=time.time_ns()
             )
             
         except Exception as e:
-            print(f"Error en transferencia TCP: {e}")
+            # Se registra y no se relanza: en el pool la excepción quedaría
+            # guardada en un Future que nadie consulta
+            log.error("Error en transferencia TCP: %s", e)
             try:
-                sock.send(pack_response(2, self.user_id))  # Status 2 = Error
+                sock.send(self._ack_err)  # Status 2 = Error
             except:
                 pass
-            raise
         finally:
             try:
                 sock.shutdown(socket.SHUT_RDWR)
@@ -646,87 +1014,90 @@ class Messaging:
                 pass
             sock.close()
 
-    def _handle_message_or_file(self, hdr, body: bytes):
-        """Procesa un mensaje o archivo recibido"""
+    def _handle_message_or_file(self, hdr, body: bytes, arrived: int = None):
+        """Procesa un mensaje o archivo recibido.
+
+        Para mensajes de texto devuelve la entrada de historial, que el
+        llamador guarda en lote; los archivos se registran directamente.
+        """
         try:
-            # Normalización de identificadores
-            # Elimina padding y espacios para comparación
-            peer_id = hdr['user_from'].rstrip(b'\x00')
-            my_id = self.raw_id.rstrip(b' ')
-            to_id = hdr['user_to'].rstrip(b' ')
-            from_id = hdr['user_from'].rstrip(b' ')
+            # Identificadores ya normalizados (unpack_header elimina el padding)
+            peer_id = hdr.user_from
+            my_id = self._my_id_key
+            to_id = hdr.user_to
             
             # Preparación de metadatos del mensaje
-            peer = peer_id.decode('utf-8', errors='ignore')
+            peer = _peer_name(peer_id)
             is_broadcast = (to_id == BROADCAST_UID)
 
-            # Logging detallado para debugging
-            print(f"Procesando mensaje/archivo de {peer} ({hdr['op_code']}) {'(broadcast)' if is_broadcast else ''}")
-            print(f"  - ID origen: {peer_id!r}")
-            print(f"  - ID destino: {to_id!r}")
-            print(f"  - ID local: {my_id!r}")
-            print(f"  - Longitud body: {len(body)} bytes")
+            # Logging detallado para debugging (solo con nivel DEBUG activo)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Procesando mensaje/archivo de %s (%d)%s",
+                          peer, hdr.op_code, " (broadcast)" if is_broadcast else "")
+                log.debug("  - ID origen: %r, ID destino: %r, ID local: %r",
+                          peer_id, to_id, my_id)
+                log.debug("  - Longitud body: %d bytes", len(body))
 
             # Procesamiento de mensajes de texto
-            if hdr['op_code'] == OP_MESSAGE:
+            if hdr.op_code == OP_MESSAGE:
                 # Extracción y validación del contenido
                 message_id, content = unpack_message_body(body)
                 # Verificación de consistencia de IDs
-                if (message_id & 0xFF) != hdr['body_id']:
-                    print(f"  - Warning: ID de mensaje no coincide: header={hdr['body_id']}, body={message_id & 0xFF}")
+                if (message_id & 0xFF) != hdr.body_id:
+                    log.warning("ID de mensaje no coincide: header=%d, body=%d",
+                                hdr.body_id, message_id & 0xFF)
                     
                 # Decodificación del texto con manejo de errores
-                text = content.decode('utf-8', errors='ignore')
-                print(f"  - Mensaje decodificado ({len(text)} chars): {text[:50]}...")
+                # str() decodifica directamente desde el memoryview, sin copia intermedia
+                text = str(content, 'utf-8', 'ignore')
+                log.debug("  - Mensaje decodificado (%d chars): %.50s...", len(text), text)
                 
-                # Registro en el historial
-                self.history_store.append_message(
-                    sender=peer,
-                    recipient="*global*" if is_broadcast else my_id.decode('utf-8'),
-                    message=text,
-                    timestamp=datetime.now(UTC)
-                )
-                print("  - Mensaje guardado en historial")
+                # Entrada para el historial (se guarda en lote)
+                return {
+                    'sender': peer,
+                    'recipient': "*global*" if is_broadcast else self._me_str,
+                    'message': text,
+                    # Instante de llegada (ns); se formatea al guardar el lote
+                    'timestamp': arrived if arrived is not None else time.time_ns()
+                }
             else:
                 # Rechazo de archivos broadcast por seguridad
                 if is_broadcast:
-                    print("  - Ignorando archivo broadcast")
+                    log.debug("  - Ignorando archivo broadcast")
                     return
                     
                 # Procesamiento de archivo recibido
-                file_id = int.from_bytes(body[:8], 'big')
+                file_id, = BODY_ID_STRUCT.unpack_from(body)
                 # Validación de consistencia del ID
-                if (file_id & 0xFF) != hdr['body_id']:
-                    print(f"  - Warning: ID de archivo no coincide: header={hdr['body_id']}, body={file_id & 0xFF}")
+                if (file_id & 0xFF) != hdr.body_id:
+                    log.warning("ID de archivo no coincide: header=%d, body=%d",
+                                hdr.body_id, file_id & 0xFF)
                     
-                # Extracción del contenido binario
-                file_data = body[8:]
+                # Extracción del contenido binario sin copiarlo
+                file_data = memoryview(body)[8:]
                 
-                # Generación de nombre único para el archivo
+                # Generación de nombre único para el archivo y almacenamiento en disco
                 timestamp = datetime.now(UTC).strftime("%Y%m%d_%H%M%S")
-                filename = f"archivo_{timestamp}_{file_id & 0xFF}.bin"
-                print(f"  - Guardando archivo como: {filename} ({len(file_data)} bytes)")
-
-                # Preparación del directorio de descargas
-                downloads_dir = os.path.join(os.getcwd(), "Descargas")
-                os.makedirs(downloads_dir, exist_ok=True)
-                path = os.path.join(downloads_dir, filename)
-                
-                # Almacenamiento del archivo en disco
-                with open(path, 'wb') as f:
-                    f.write(file_data)
+                fd, filename = _create_unique(self._downloads_dir,
+                                              f"archivo_{timestamp}_{file_id & 0xFF}",
+                                              ".bin")
+                log.debug("  - Guardando archivo como: %s (%d bytes)", filename, len(file_data))
+                try:
+                    _write_all(fd, file_data)
+                    _drop_cached_pages(fd)
+                finally:
+                    os.close(fd)
 
                 # Registro en el historial de transferencias
                 self.history_store.append_file(
                     sender=peer,
-                    recipient=my_id.decode('utf-8'),
+                    recipient=self._me_str,
                     filename=filename,
-                    timestamp=datetime.now(UTC)
+                    timestamp=time.time_ns()
                 )
-                print("  - Archivo guardado en Descargas/")
+                log.debug("  - Archivo guardado en Descargas/")
         except Exception as e:
             # Logging detallado de errores para debugging
-            print(f"Error procesando mensaje/archivo: {e}")
-            print(f"  - Header: {hdr}")
-            print(f"  - Body length: {len(body)}")
+            log.error("Error procesando mensaje/archivo: %s (header=%r, body=%d bytes)",
+                      e, hdr, len(body))
             # Supresión de excepciones para mantener el sistema funcionando
@@ -5,6 +5,7 @@
 # cuerpo variable y respuestas de 25 bytes para comunicación entre peers
 
 import struct
+from typing import NamedTuple
 
 # Puertos para comunicación
 UDP_PORT = 9990  # Puerto para descubrimiento
@@ -45,6 +46,34 @@ BROADCAST_UID = b'\xff' * USER_ID_SIZE
 # 4x: 4 bytes de padding
 RESPONSE_FMT = '!B20s4x'
 
+# Formato de empaquetado para cabeceras (100 bytes)
+# 20s/20s: remitente y destinatario (struct rellena con nulos y trunca)
+# B/B: código de operación e ID de cuerpo
+# Q: longitud del cuerpo (8 bytes), 50x: reservado
+HEADER_FMT = '!20s20sBBQ50x'
+
+# Prefijo de 8 bytes (big-endian) con el ID del cuerpo o del archivo
+BODY_ID_FMT = '!Q'
+
+# Estructuras precompiladas: evitan reinterpretar el formato en cada paquete
+HEADER_STRUCT = struct.Struct(HEADER_FMT)
+RESPONSE_STRUCT = struct.Struct(RESPONSE_FMT)
+BODY_ID_STRUCT = struct.Struct(BODY_ID_FMT)
+
+# Cabecera desempaquetada (IDs sin padding nulo)
+# Tupla con nombre: acceso por atributo sin construir un dict por paquete
+class Header(NamedTuple):
+    user_from: bytes
+    user_to: bytes
+    op_code: int
+    body_id: int
+    body_len: int
+
+# Respuesta desempaquetada (responder sin padding nulo)
+class Response(NamedTuple):
+    status: int
+    responder: bytes
+
 # Códigos de operación soportados por el protocolo
 OP_ECHO = 0    # Operación de eco para verificar conectividad
 OP_MESSAGE = 1 # Operación de envío de mensaje de texto
@@ -74,45 +103,32 @@ def pack_header(user_from: bytes,
     if not 0 <= body_len <= (2**64 - 1):
         raise ValueError(f"body_len fuera de rango")
 
-    header = bytearray(HEADER_SIZE)
-    
-    # Procesamiento de identificadores: aseguramos exactamente 20 bytes
-    # Se usa relleno con null bytes si es necesario
-    header[0:USER_ID_SIZE] = user_from.ljust(USER_ID_SIZE, b'\x00')[:USER_ID_SIZE]
-    header[USER_ID_SIZE:2*USER_ID_SIZE] = user_to.ljust(USER_ID_SIZE, b'\x00')[:USER_ID_SIZE]
-    
-    # Códigos de operación y cuerpo: 1 byte cada uno
-    header[40] = op_code
-    header[41] = body_id
-    
-    # Longitud del cuerpo: 8 bytes en big-endian
-    header[42:50] = body_len.to_bytes(BODY_LENGTH_SIZE, 'big')
-    
-    return bytes(header)
+    # Los IDs se rellenan/truncan a 20 bytes y la longitud va en big-endian
+    return HEADER_STRUCT.pack(user_from, user_to, op_code, body_id, body_len)
 
 # Desempaqueta y valida una cabecera recibida
 # Esta función es esencial porque:
 # 1. Verifica la integridad de los datos recibidos
 # 2. Extrae los campos en formato utilizable
 # 3. Valida los valores de los campos
-def unpack_header(data: bytes) -> dict:
+def unpack_header(data: bytes) -> Header:
     if len(data) < HEADER_SIZE:
         raise ValueError(f"Header demasiado corto: {len(data)} bytes (esperado {HEADER_SIZE})")
         
-    h = data[:HEADER_SIZE]
+    # unpack_from lee directamente del buffer, sin recortar una copia
+    user_from, user_to, op_code, body_id, body_len = HEADER_STRUCT.unpack_from(data)
     
     # Validación del código de operación
-    op_code = h[40]
     if op_code not in (OP_ECHO, OP_MESSAGE, OP_FILE):
         raise ValueError(f"op_code inválido: {op_code}")
         
-    return {
-        'user_from': h[0:USER_ID_SIZE].rstrip(b'\x00'),
-        'user_to': h[USER_ID_SIZE:2*USER_ID_SIZE].rstrip(b'\x00'),
-        'op_code': op_code,
-        'body_id': h[41],
-        'body_len': int.from_bytes(h[42:50], 'big')
-    }
+    return Header(
+        user_from.rstrip(b'\x00'),
+        user_to.rstrip(b'\x00'),
+        op_code,
+        body_id,
+        body_len
+    )
 
 # Empaqueta una respuesta según el protocolo
 # Esta función es importante porque:
@@ -125,29 +141,24 @@ def pack_response(status: int, responder: bytes) -> bytes:
     if not isinstance(responder, bytes):
         raise ValueError("responder debe ser bytes")
         
-    # Aseguramos que el identificador tenga exactamente 20 bytes
-    resp_id = responder.ljust(USER_ID_SIZE, b'\x00')[:USER_ID_SIZE]
-    
-    return struct.pack(RESPONSE_FMT, status, resp_id)
+    # El formato 20s asegura exactamente 20 bytes (relleno nulo o truncado)
+    return RESPONSE_STRUCT.pack(status, responder)
 
 # Desempaqueta y valida una respuesta recibida
 # Esta función es necesaria porque:
 # 1. Verifica el tamaño correcto de la respuesta
 # 2. Valida el código de estado
 # 3. Extrae el identificador del respondedor
-def unpack_response(data: bytes) -> dict:
+def unpack_response(data: bytes) -> Response:
     if len(data) < RESPONSE_SIZE:
         raise ValueError(f"Response demasiado corto: {len(data)} bytes (esperado {RESPONSE_SIZE})")
         
-    status, responder = struct.unpack('!B20s', data[:21])
+    status, responder = RESPONSE_STRUCT.unpack_from(data)
     
     if status not in (RESP_OK, RESP_BAD_REQUEST, RESP_INTERNAL_ERROR):
         raise ValueError(f"status inválido: {status}")
         
-    return {
-        'status': status,
-        'responder': responder.rstrip(b'\x00')
-    }
+    return Response(status, responder.rstrip(b'\x00'))
 
 # Empaqueta el cuerpo de un mensaje
 # Esta función es importante porque:
@@ -164,11 +175,12 @@ def pack_message_body(body_id: int, message: bytes) -> bytes:
 # Esta función es necesaria porque:
 # 1. Verifica el tamaño mínimo del cuerpo
 # 2. Separa el ID del contenido
-# 3. Devuelve los componentes en formato utilizable
+# 3. Devuelve el contenido como memoryview, sin copiarlo
 def unpack_message_body(data: bytes) -> tuple:
     if len(data) < 8:
         raise ValueError("Cuerpo de mensaje demasiado corto")
         
-    message_id = int.from_bytes(data[:8], 'big')
-    content = data[8:]
+    # unpack_from lee el ID en su sitio, sin recortar los 8 bytes
+    message_id, = BODY_ID_STRUCT.unpack_from(data)
+    content = memoryview(data)[BODY_ID_STRUCT.size:]
     return message_id, content
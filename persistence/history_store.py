@@ -5,7 +5,17 @@
 import os
 import json
 from datetime import datetime, UTC
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
+
+# Convierte un timestamp a ISO 8601 con zona UTC
+# Acepta datetime o entero en nanosegundos desde epoch (time.time_ns()),
+# de modo que los llamadores en caminos críticos no construyan un datetime
+def _to_iso(timestamp: Union[datetime, int]) -> str:
+    if isinstance(timestamp, int):
+        timestamp = datetime.fromtimestamp(timestamp / 1e9, UTC)
+    elif timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=UTC)
+    return timestamp.isoformat()
 
 # Gestiona almacenamiento de historial de comunicaciones
 # Registra interacciones y permite acceso a conversaciones privadas/globales
@@ -21,51 +31,65 @@ class HistoryStore:
 
     # Agrega entrada al historial con normalización de timestamp
     def _append(self, entry: Dict[str, Any]):
+        self._extend([entry])
+
+    # Agrega varias entradas con una sola lectura y escritura del archivo
+    # Es la operación base: cada escritura reescribe el JSON completo
+    def _extend(self, entries: List[Dict[str, Any]]):
         try:
             history = self.load_raw()
         except Exception:
             history = []
 
-        # Normalización del timestamp a formato ISO con zona horaria UTC
-        # Esto es crucial para mantener consistencia temporal en la aplicación
-        if isinstance(entry['timestamp'], datetime):
-            if entry['timestamp'].tzinfo is None:
-                entry['timestamp'] = entry['timestamp'].replace(tzinfo=UTC)
-            entry['timestamp'] = entry['timestamp'].isoformat()
+        for entry in entries:
+            # Normalización del timestamp a formato ISO con zona horaria UTC
+            # Esto es crucial para mantener consistencia temporal en la aplicación
+            if not isinstance(entry['timestamp'], str):
+                entry['timestamp'] = _to_iso(entry['timestamp'])
+            history.append(entry)
 
-        history.append(entry)
         with open(self.path, 'w', encoding='utf-8') as f:
             json.dump(history, f, ensure_ascii=False, indent=2)
 
     # Agrega un mensaje de texto al historial
     # Los parámetros incluyen remitente, destinatario, contenido y timestamp
-    def append_message(self, sender: str, recipient: str, message: str, timestamp: datetime):
-        # Aseguramos consistencia temporal con UTC
-        if timestamp.tzinfo is None:
-            timestamp = timestamp.replace(tzinfo=UTC)
-            
+    def append_message(self, sender: str, recipient: str, message: str,
+                       timestamp: Union[datetime, int]):
         entry = {
             'type': 'message',
             'sender': sender,
             'recipient': recipient,
             'message': message,
-            'timestamp': timestamp.isoformat()
+            'timestamp': _to_iso(timestamp)  # Consistencia temporal con UTC
         }
         self._append(entry)
 
+    # Agrega un lote de mensajes de texto al historial en una sola escritura
+    # Cada entrada lleva las mismas claves que los argumentos de append_message
+    def append_messages(self, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        self._extend([
+            {
+                'type': 'message',
+                'sender': e['sender'],
+                'recipient': e['recipient'],
+                'message': e['message'],
+                'timestamp': e['timestamp']
+            }
+            for e in entries
+        ])
+
     # Agrega un registro de transferencia de archivo al historial
     # Similar a append_message pero para archivos
-    def append_file(self, sender: str, recipient: str, filename: str, timestamp: datetime):
-        # Aseguramos consistencia temporal con UTC
-        if timestamp.tzinfo is None:
-            timestamp = timestamp.replace(tzinfo=UTC)
-            
+    def append_file(self, sender: str, recipient: str, filename: str,
+                    timestamp: Union[datetime, int]):
         entry = {
             'type': 'file',
             'sender': sender,
             'recipient': recipient,
             'filename': filename,
-            'timestamp': timestamp.isoformat()
+            'timestamp': _to_iso(timestamp)  # Consistencia temporal con UTC
         }
         self._append(entry)
 
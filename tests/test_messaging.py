@@ -0,0 +1,168 @@
+# Pruebas de mensajería LCP entre dos peers sobre loopback
+# Cada peer escucha en su propia IP de loopback (127.0.0.1 y 127.0.0.2)
+# con un descubrimiento fijo que solo conoce al otro peer
+
+import os
+import sys
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, UTC
+
+import pytest
+
+# Configuración del path para importaciones
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import core.messaging as messaging_mod
+from core.messaging import Messaging
+from core.protocol import (
+    UDP_PORT,
+    OP_MESSAGE,
+    RESPONSE_SIZE,
+    pack_header,
+    pack_message_body,
+    pack_response,
+)
+from persistence.history_store import HistoryStore
+
+# Solo Linux enruta todo 127.0.0.0/8 a loopback sin configuración extra
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                                reason="requiere 127.0.0.2 en loopback")
+
+ALICE = b'alice'.ljust(20, b'\x00')
+BOB = b'bob'.ljust(20, b'\x00')
+
+
+# Descubrimiento fijo: socket UDP propio y un único peer conocido
+class StaticDiscovery:
+    def __init__(self, ip: str, peer_id: bytes, peer_ip: str):
+        self.local_ip = ip
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, UDP_PORT))
+        self.peers = {peer_id: {'ip': peer_ip, 'last_seen': datetime.now(UTC)}}
+
+    def get_peers(self):
+        return self.peers
+
+    def get_peer(self, uid: bytes):
+        return self.peers.get(uid)
+
+    def handle_echo(self, data, addr):
+        pass
+
+    def handle_response(self, data, addr):
+        pass
+
+    def discover_peers(self):
+        pass
+
+
+# Puerto TCP libre para que cada peer tenga su propio listener
+def _free_tcp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Crea un peer y arranca su bucle de recepción
+def _start_peer(name: bytes, ip: str, peer_id: bytes, peer_ip: str, history_path: str):
+    discovery = StaticDiscovery(ip, peer_id, peer_ip)
+    peer = Messaging(name, discovery, HistoryStore(history_path))
+    thread = threading.Thread(target=peer.recv_loop, daemon=True)
+    thread.start()
+    return peer, thread
+
+
+# Cierra un peer y espera a que su bucle de recepción libere el socket UDP
+def _stop_peer(peer, thread):
+    peer.close()
+    try:
+        peer.sock.shutdown(socket.SHUT_RDWR)  # Despierta la recepción bloqueada
+    except OSError:
+        pass
+    thread.join(timeout=10)
+    peer.sock.close()
+
+
+# Par alice→bob; TCP_PORT queda apuntando al listener de bob
+@pytest.fixture
+def peers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Descargas/ se crea en el directorio actual
+    monkeypatch.setattr(messaging_mod, 'TCP_PORT', _free_tcp_port())
+    alice = _start_peer(b'alice', '127.0.0.1', BOB, '127.0.0.2', str(tmp_path / 'alice.json'))
+    monkeypatch.setattr(messaging_mod, 'TCP_PORT', _free_tcp_port())
+    bob = _start_peer(b'bob', '127.0.0.2', ALICE, '127.0.0.1', str(tmp_path / 'bob.json'))
+    yield alice[0], bob[0]
+    for peer, thread in (alice, bob):
+        _stop_peer(peer, thread)
+
+
+# Espera a que el historial de un peer tenga al menos count entradas
+def _wait_history(peer, count: int, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        entries = peer.history_store.load_raw()
+        if len(entries) >= count:
+            return entries
+        time.sleep(0.05)
+    return peer.history_store.load_raw()
+
+
+def test_concurrent_broadcast_and_send_deliver_every_message(peers):
+    alice, bob = peers
+    direct = [f"directo {i}".encode() for i in range(6)]
+    globales = [f"global {i}".encode() for i in range(4)]
+
+    with ThreadPoolExecutor(max_workers=len(direct) + len(globales)) as pool:
+        futures = [pool.submit(alice.send, BOB, m) for m in direct]
+        futures += [pool.submit(alice.broadcast, m) for m in globales]
+        for future in futures:
+            future.result(timeout=30)
+
+    expected = sorted(m.decode() for m in direct + globales)
+    entries = _wait_history(bob, len(expected))
+    assert sorted(e['message'] for e in entries) == expected
+
+
+def test_ack_with_body_length_is_not_taken_as_pending_body(peers):
+    alice, bob = peers
+    # 8 bytes de body_id + 17 de texto: el cuerpo mide lo mismo que un ACK
+    body = pack_message_body(5, b'diecisiete bytes!')
+    assert len(body) == RESPONSE_SIZE
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as raw:
+        raw.bind(('127.0.0.1', 0))
+        raw.settimeout(2.0)
+        raw.sendto(pack_header(ALICE, BOB, OP_MESSAGE, 5, len(body)), ('127.0.0.2', UDP_PORT))
+        assert raw.recv(64)[0] == 0
+        # ACK de un envío propio en curso, intercalado antes del cuerpo
+        raw.sendto(pack_response(0, ALICE), ('127.0.0.2', UDP_PORT))
+        raw.sendto(body, ('127.0.0.2', UDP_PORT))
+        assert raw.recv(64)[0] == 0
+
+    _wait_history(bob, 1)
+    time.sleep(0.2)  # Margen para que un mensaje espurio también llegue al historial
+    assert [e['message'] for e in bob.history_store.load_raw()] == ['diecisiete bytes!']
+
+
+# Con y sin os.sendfile: sin él se envía desde un mapeo del archivo
+@pytest.mark.parametrize('use_sendfile', [True, False], ids=['sendfile', 'mmap'])
+def test_send_file_path_delivers_file_contents(peers, tmp_path, monkeypatch, use_sendfile):
+    alice, bob = peers
+    if not use_sendfile:
+        monkeypatch.delattr(os, 'sendfile')
+    # Más grande que un buffer de socket para que el envío use varios segmentos
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    source = tmp_path / 'origen.bin'
+    source.write_bytes(content)
+
+    alice.send_file_path(BOB, str(source), 'origen.bin')
+
+    entries = _wait_history(bob, 1)
+    assert [e['type'] for e in entries] == ['file']
+    received = tmp_path / 'Descargas' / entries[0]['filename']
+    assert received.read_bytes() == content
@@ -87,25 +87,13 @@ if st.sidebar.button("🔍 Buscar Peers"):
 # 3. Clasifica peers por estado de conexión
 now = datetime.now(UTC)
 
-raw_peers = engine.discovery.get_peers()  # Obtiene diccionario de peers activos
-
 # Proceso de unificación de formatos de ID
 # Esta sección es crítica porque:
 # 1. Normaliza IDs en bytes y strings
 # 2. Mantiene la consistencia de datos
 # 3. Facilita la búsqueda y comparación
-peers = []
-for uid_key, info in raw_peers.items():
-    if isinstance(uid_key, bytes):
-        trimmed = uid_key.rstrip(b'\x00')
-        name_str = trimmed.decode('utf-8', errors='ignore')
-        uid_bytes = trimmed.ljust(20, b'\x00')
-    else:
-        name_str = uid_key
-        b = name_str.encode('utf-8')
-        trimmed = b[:20]
-        uid_bytes = trimmed.ljust(20, b'\x00')
-    peers.append((name_str, uid_bytes, info))
+# Discovery memoiza la decodificación, así que cada ID se procesa una sola vez
+peers = list(engine.discovery.iter_peer_ids_decoded())
 
 # Mapeo inverso para búsqueda rápida
 # Permite convertir nombres a IDs binarios